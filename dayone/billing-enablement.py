@@ -1,36 +1,84 @@
+import atexit
+import itertools
 import os
+import random
 import re
+import select
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-try:
+# Pattern to detect our date suffix (e.g., "-202602181530"). Matching is done
+# with the cheaper string checks in _suffix(); the regex documents the format.
+SUFFIX_PATTERN = re.compile(r"-\d{12}$")
+SUFFIX_LENGTH = 13
+
+# Upper bound on how many billing accounts are listed
+MAX_BILLING_ACCOUNTS = 200
+
+# Cloud Billing clients created by get_client(), keyed on quota project
+_clients = {}
+
+# How long the manual selection prompt waits before keeping the auto-selection
+MANUAL_SELECTION_TIMEOUT_SECONDS = 5
+
+
+def _import_billing():
+    """Binds the Cloud Billing library names used throughout this module."""
+    global billing_v1, exceptions, ClientOptions
     from google.cloud import billing_v1
     from google.api_core import exceptions
     from google.api_core.client_options import ClientOptions
+
+
+def _ensure_deps():
+    """Installs google-cloud-billing only if it is not already importable."""
+    try:
+        _import_billing()
+    except ImportError:
+        print("Installing google-cloud-billing...")
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--quiet",
+                "--user",
+                "--break-system-packages",
+                "google-cloud-billing",
+            ]
+        )
+        _import_billing()
+
+
+# Bind the library names on import when they are already installed; a fresh
+# environment gets them from _ensure_deps() when run as a script.
+try:
+    _import_billing()
 except ImportError:
-    print("Installing google-cloud-billing...")
-    subprocess.check_call(
-        [
-            sys.executable,
-            "-m",
-            "pip",
-            "install",
-            "--quiet",
-            "--user",
-            "--break-system-packages",
-            "google-cloud-billing",
-        ]
-    )
-    from google.cloud import billing_v1
-    from google.api_core import exceptions
-    from google.api_core.client_options import ClientOptions
+    pass
 
-# Pattern to detect our date suffix (e.g., "-202602181530")
-SUFFIX_PATTERN = re.compile(r"-\d{12}$")
 
-# --- No changes to the functions in this section ---
+def get_client(project_id):
+    """Returns the process-wide Cloud Billing client for the project."""
+    if project_id not in _clients:
+        _clients[project_id] = billing_v1.CloudBillingClient(
+            client_options=ClientOptions(quota_project_id=project_id)
+        )
+    return _clients[project_id]
+
+
+def _close_clients():
+    """Closes the channels of the clients created by get_client()."""
+    for client in _clients.values():
+        client.transport.close()
+    _clients.clear()
+
+
+atexit.register(_close_clients)
 
 
 def get_project_id_from_file():
@@ -84,28 +132,57 @@ def enable_billing_api(project_id):
         return False
 
 
-def get_linked_project_count(client, billing_account) -> int:
-    """Count the number of projects linked to a billing account."""
+def has_linked_project(client, billing_account) -> bool:
+    """Check whether any project is linked to a billing account."""
     try:
-        projects = client.list_project_billing_info(name=billing_account.name)
-        count = 0
-        for _ in projects:
-            count += 1
-            if count > 0:
-                break
-        return count
+        request = billing_v1.ListProjectBillingInfoRequest(
+            name=billing_account.name, page_size=1
+        )
+        projects = client.list_project_billing_info(request=request)
+        return next(iter(projects), None) is not None
     except Exception:
-        return -1
+        # Treat errors as linked so an unknown account is never preferred
+        return True
+
+
+def _suffix_match(name):
+    """Returns True if the name ends with our date suffix."""
+    return (
+        len(name) >= SUFFIX_LENGTH
+        and name[-SUFFIX_LENGTH] == "-"
+        and name[-SUFFIX_LENGTH + 1 :].isdecimal()
+    )
+
+
+def _suffix(name):
+    """Returns the date suffix of the name, or None if it has none."""
+    return name[-SUFFIX_LENGTH:] if _suffix_match(name) else None
 
 
 def find_best_billing_account(client, open_accounts: list) -> object:
     """Select the best billing account using a heuristic."""
-    # Priority 1: Find account with no linked projects (freshest)
-    unlinked_accounts = []
+    # Priority 1: Among tagged accounts, pick the one with the newest suffix.
+    # This is a local check, so it runs before any per-account RPCs.
+    tagged_accounts = []
     for account in open_accounts:
-        linked_count = get_linked_project_count(client, account)
-        if linked_count == 0:
-            unlinked_accounts.append(account)
+        suffix = _suffix(account.display_name)
+        if suffix:
+            tagged_accounts.append((account, suffix))
+
+    if tagged_accounts:
+        tagged_accounts.sort(key=lambda x: x[1], reverse=True)
+        account = tagged_accounts[0][0]
+        print(f"   Selected newest tagged account: {account.display_name}")
+        return account
+
+    # Priority 2: Find account with no linked projects (freshest)
+    with ThreadPoolExecutor(max_workers=min(16, len(open_accounts))) as executor:
+        linked = list(
+            executor.map(lambda a: has_linked_project(client, a), open_accounts)
+        )
+    unlinked_accounts = [
+        account for account, is_linked in zip(open_accounts, linked) if not is_linked
+    ]
 
     if unlinked_accounts:
         unlinked_accounts.sort(
@@ -116,19 +193,6 @@ def find_best_billing_account(client, open_accounts: list) -> object:
         print(f"   Selected unlinked (fresh) account: {account.display_name}")
         return account
 
-    # Priority 2: Among tagged accounts, pick the one with the newest suffix
-    tagged_accounts = []
-    for account in open_accounts:
-        match = SUFFIX_PATTERN.search(account.display_name)
-        if match:
-            tagged_accounts.append((account, match.group()))
-
-    if tagged_accounts:
-        tagged_accounts.sort(key=lambda x: x[1], reverse=True)
-        account = tagged_accounts[0][0]
-        print(f"   Selected newest tagged account: {account.display_name}")
-        return account
-
     # Priority 3: Fallback to first account
     account = open_accounts[0]
     print(f"   No unlinked or tagged accounts. Using: {account.display_name}")
@@ -137,7 +201,7 @@ def find_best_billing_account(client, open_accounts: list) -> object:
 
 def tag_billing_account(client, account) -> None:
     """Tag billing account with date suffix for future identification."""
-    if SUFFIX_PATTERN.search(account.display_name):
+    if _suffix_match(account.display_name):
         return
 
     suffix = datetime.now().strftime("-%Y%m%d%H%M")
@@ -159,10 +223,19 @@ def tag_billing_account(client, account) -> None:
 
 def get_billing_accounts(client):
     """Fetches a list of billing accounts with improved error handling."""
+    # Listings are not cached: the retry loops only list again after an error
+    # or an empty result, and a cache kept across runs would hide a credit
+    # claimed just before re-running init.sh.
     print("Fetching billing accounts...")
     try:
-        accounts = client.list_billing_accounts()
-        return list(accounts)
+        pager = client.list_billing_accounts()
+        accounts = list(itertools.islice(pager, MAX_BILLING_ACCOUNTS + 1))
+        if len(accounts) > MAX_BILLING_ACCOUNTS:
+            accounts = accounts[:MAX_BILLING_ACCOUNTS]
+            print(
+                f"Warning: Only the first {MAX_BILLING_ACCOUNTS} billing accounts were checked."
+            )
+        return accounts
     except exceptions.PermissionDenied as e:
         error_message = e.message.lower()
         print(f"\n--- DEBUG: Caught PermissionDenied Exception ---")
@@ -188,6 +261,24 @@ def get_billing_accounts(client):
         return "UNEXPECTED_ERROR"
 
 
+def is_billing_link_active(client, project_name, billing_account_name, attempt):
+    """Checks once whether the project is actively billed to the given account."""
+    try:
+        # Always a fresh read: verification needs the live state, and a project
+        # is only re-read after the manual prompt, long after a short-lived
+        # memo of this call would have expired.
+        verified_info = client.get_project_billing_info(name=project_name)
+        if (
+            verified_info.billing_account_name == billing_account_name
+            and verified_info.billing_enabled
+        ):
+            return True
+        print(f"Verification attempt {attempt}: Link not active yet.")
+    except Exception as e:
+        print(f"An unexpected error occurred during verification: {e}")
+    return False
+
+
 def link_project_to_billing(client, target_project_id, billing_account_info):
     """Links a project and then verifies that the link is active."""
     if not target_project_id:
@@ -197,33 +288,33 @@ def link_project_to_billing(client, target_project_id, billing_account_info):
         return
     project_name = f"projects/{target_project_id}"
     billing_account_name = billing_account_info.name
-    try:
-        print(f"\nChecking current billing status for project '{target_project_id}'...")
-        current_billing_info = client.get_project_billing_info(name=project_name)
-        if current_billing_info.billing_account_name == billing_account_name:
-            print(
-                f"Success: Project is already linked to the target billing account '{billing_account_info.display_name}'."
-            )
-            return
-        if current_billing_info.billing_enabled:
-            print(
-                f"Project is currently linked to a different billing account: '{current_billing_info.billing_account_name}'"
-            )
-    except exceptions.NotFound:
-        print("Project is not currently linked to any billing account.")
-
     print(
-        f"Proceeding to link project to '{billing_account_info.display_name}' ({billing_account_name})."
+        f"\nLinking project '{target_project_id}' to '{billing_account_info.display_name}' ({billing_account_name})."
     )
     project_billing_info = billing_v1.ProjectBillingInfo(
         billing_account_name=billing_account_name
     )
 
+    # The update is idempotent, so there is no need to read the current link
+    # first; the project's state is only fetched to explain a rejected update.
     try:
-        client.update_project_billing_info(
+        updated_info = client.update_project_billing_info(
             name=project_name, project_billing_info=project_billing_info
         )
         print(f"\nSuccessfully sent link request.")
+    except (exceptions.Conflict, exceptions.FailedPrecondition) as e:
+        print(f"\nError: The link request was rejected. Message: {e.message}")
+        try:
+            current_billing_info = client.get_project_billing_info(name=project_name)
+            if current_billing_info.billing_enabled:
+                print(
+                    f"Project is currently linked to billing account: '{current_billing_info.billing_account_name}'"
+                )
+            else:
+                print("Project is not currently linked to any billing account.")
+        except Exception:
+            pass
+        return
     except exceptions.PermissionDenied as e:
         print(
             f"\nError: Permission Denied. You may not have 'roles/billing.projectManager' on the project. Message: {e.message}"
@@ -233,32 +324,79 @@ def link_project_to_billing(client, target_project_id, billing_account_info):
         print(f"\nAn unexpected error occurred during the linking process: {e}")
         return
 
+    # The update returns the new billing info; if it already shows the link as
+    # active there is nothing to verify
+    if (
+        updated_info.billing_account_name == billing_account_name
+        and updated_info.billing_enabled
+    ):
+        print(
+            f"Success! Billing link for project '{target_project_id}' is confirmed active."
+        )
+        return
+
     print("Now, verifying that the billing link is active...")
-    max_retries = 6
-    wait_seconds = 10
-    for i in range(max_retries):
-        try:
-            verified_info = client.get_project_billing_info(name=project_name)
-            if (
-                verified_info.billing_account_name == billing_account_name
-                and verified_info.billing_enabled
-            ):
-                print(
-                    f"Success! Billing link for project '{target_project_id}' is confirmed active."
-                )
-                return
-            print(f"Verification attempt {i + 1}/{max_retries}: Link not active yet.")
-        except Exception as e:
-            print(f"An unexpected error occurred during verification: {e}")
-        time.sleep(wait_seconds)
-    print(
-        f"\nWarning: Could not verify billing link was active after {max_retries} attempts."
-    )
+    timeout_seconds = 60
+    deadline = time.monotonic() + timeout_seconds
+
+    # A check issued right after the update usually sees the old state, so
+    # wait briefly first. Most links are active after one short propagation
+    # delay, so check twice before falling back to the backoff loop.
+    time.sleep(1)
+    verified = is_billing_link_active(client, project_name, billing_account_name, 1)
+    if not verified:
+        time.sleep(5)
+        verified = is_billing_link_active(client, project_name, billing_account_name, 2)
+
+    delay = 5.0
+    attempt = 2
+    while not verified and time.monotonic() < deadline:
+        # Clamp the sleep so the last check lands on the deadline, not past it
+        sleep_seconds = delay + random.uniform(0, delay * 0.2)
+        time.sleep(max(0, min(sleep_seconds, deadline - time.monotonic())))
+        delay = min(delay * 1.7, 10)
+        attempt += 1
+        verified = is_billing_link_active(
+            client, project_name, billing_account_name, attempt
+        )
+
+    if verified:
+        print(
+            f"Success! Billing link for project '{target_project_id}' is confirmed active."
+        )
+    else:
+        print(
+            f"\nWarning: Could not verify billing link was active after {timeout_seconds} seconds."
+        )
+
+
+def link_and_tag_billing_account(client, target_project_id, billing_account_info):
+    """Links the project and tags the account concurrently."""
+    # Tagging only needs the account, not the link result
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        link_future = executor.submit(
+            link_project_to_billing, client, target_project_id, billing_account_info
+        )
+        tag_future = executor.submit(tag_billing_account, client, billing_account_info)
+        link_future.result()
+        tag_future.result()
+
+
+def read_choice_with_timeout(prompt, timeout_seconds):
+    """Prompts and reads a line from stdin, or returns "" on timeout."""
+    print(prompt, end="", flush=True)
+    ready, _, _ = select.select([sys.stdin], [], [], timeout_seconds)
+    if not ready:
+        print()
+        return ""
+    return sys.stdin.readline().strip()
 
 
 # --- MAIN BLOCK ---
 
 if __name__ == "__main__":
+    _ensure_deps()
+
     print("--- Starting GCP Billing Management Script ---")
     project_id = get_project_id_from_file()
 
@@ -267,9 +405,7 @@ if __name__ == "__main__":
             "\nScript finished with a critical error: Could not determine Project ID."
         )
     else:
-        billing_client = billing_v1.CloudBillingClient(
-            client_options=ClientOptions(quota_project_id=project_id)
-        )
+        billing_client = get_client(project_id)
         accounts_result = get_billing_accounts(billing_client)
 
         if accounts_result == "API_DISABLED_OR_NO_PERMISSION":
@@ -333,8 +469,9 @@ if __name__ == "__main__":
                     print(
                         f"Selected the only open account: '{target_account.display_name}'"
                     )
-                    link_project_to_billing(billing_client, project_id, target_account)
-                    tag_billing_account(billing_client, target_account)
+                    link_and_tag_billing_account(
+                        billing_client, project_id, target_account
+                    )
                 else:
                     print(f"\nFound {len(open_accounts)} billing accounts")
                     target_account = find_best_billing_account(
@@ -343,41 +480,49 @@ if __name__ == "__main__":
                     print(f"Auto-selecting: {target_account.display_name}")
 
                     # Try to link auto-selected account
-                    link_project_to_billing(billing_client, project_id, target_account)
-                    tag_billing_account(billing_client, target_account)
-
-                    # Adding a manual fallback option if the user wants to override
-                    print("\n--- Manual Selection Fallback ---")
-                    print(
-                        "If you wish to select a different account, please enter its number below."
+                    link_and_tag_billing_account(
+                        billing_client, project_id, target_account
                     )
-                    for i, acc in enumerate(open_accounts, 1):
-                        print(f"{i}. {acc.display_name} ({acc.name})")
 
-                    print(
-                        "\nPress Enter to continue with the auto-selected account, or enter a number [1-%d]:"
-                        % len(open_accounts)
-                    )
-                    try:
-                        choice = input("> ").strip()
-                        if choice:
-                            idx = int(choice) - 1
-                            if 0 <= idx < len(open_accounts):
-                                target_account = open_accounts[idx]
-                                print(
-                                    f"Switching to manual selection: {target_account.display_name}"
-                                )
-                                link_project_to_billing(
-                                    billing_client, project_id, target_account
-                                )
-                                tag_billing_account(billing_client, target_account)
-                            else:
-                                print(
-                                    "Invalid selection. Proceeding with initial auto-selection."
-                                )
-                    except (ValueError, EOFError):
-                        # Empty input or non-numeric means stick with auto-selected
-                        pass
+                    # Adding a manual fallback option if the user wants to override
+                    if not sys.stdin.isatty():
+                        print(
+                            "\nNon-interactive run: keeping the auto-selected account."
+                        )
+                    else:
+                        print("\n--- Manual Selection Fallback ---")
+                        print(
+                            "If you wish to select a different account, please enter its number below."
+                        )
+                        for i, acc in enumerate(open_accounts, 1):
+                            print(f"{i}. {acc.display_name} ({acc.name})")
+
+                        try:
+                            choice = read_choice_with_timeout(
+                                "\nPress Enter to continue with the auto-selected account, or enter a number [1-%d] within %d seconds:\n> "
+                                % (
+                                    len(open_accounts),
+                                    MANUAL_SELECTION_TIMEOUT_SECONDS,
+                                ),
+                                MANUAL_SELECTION_TIMEOUT_SECONDS,
+                            )
+                            if choice:
+                                idx = int(choice) - 1
+                                if 0 <= idx < len(open_accounts):
+                                    target_account = open_accounts[idx]
+                                    print(
+                                        f"Switching to manual selection: {target_account.display_name}"
+                                    )
+                                    link_and_tag_billing_account(
+                                        billing_client, project_id, target_account
+                                    )
+                                else:
+                                    print(
+                                        "Invalid selection. Proceeding with initial auto-selection."
+                                    )
+                        except (ValueError, EOFError):
+                            # Empty input or non-numeric means stick with auto-selected
+                            pass
 
         elif accounts_result == "API_DISABLED_OR_NO_PERMISSION":
             print(
@@ -19,39 +19,75 @@ After selection, the account is tagged with a date suffix (e.g. -202602181530)
 so subsequent runs can identify it.
 """
 
+from __future__ import annotations
+
+import functools
 import os
+import random
 import re
+import select
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-try:
-    from google.cloud import billing_v1
-    from google.api_core import exceptions
-    from google.api_core.client_options import ClientOptions
-except ImportError:
-    print("Installing google-cloud-billing...")
-    subprocess.check_call(
-        [
-            sys.executable,
-            "-m",
-            "pip",
-            "install",
-            "--quiet",
-            "--user",
-            "--break-system-packages",
-            "google-cloud-billing",
-        ]
-    )
-    from google.cloud import billing_v1
-    from google.api_core import exceptions
-    from google.api_core.client_options import ClientOptions
-
-
 # Pattern to detect our date suffix (e.g., "-202602181530")
 SUFFIX_PATTERN = re.compile(r"-\d{12}$")
 
+# Accounts probed concurrently per batch when looking for an unlinked account
+PROBE_BATCH_SIZE = 16
+
+# Seconds to wait for a manual account choice before picking the first one
+MANUAL_SELECTION_TIMEOUT = 30
+
+# Whether the terminal cursor is still on an in-place progress line
+_progress_line_open = False
+
+
+def print_progress(message: str) -> None:
+    """Rewrite the current terminal line with a retry/progress message.
+
+    Retry loops update one line instead of adding a line per attempt. When
+    stdout isn't a terminal (CI, log files), each message is its own line.
+    """
+    global _progress_line_open
+    if not sys.stdout.isatty():
+        print(message)
+        return
+    # \033[K clears what is left of a longer previous message
+    print(f"\r{message}\033[K", end="", flush=True)
+    _progress_line_open = True
+
+
+def end_progress() -> None:
+    """Finish an open progress line so the next print starts on a new line."""
+    global _progress_line_open
+    if _progress_line_open:
+        print()
+        _progress_line_open = False
+
+
+def _lazy_import_billing() -> None:
+    """Import the Cloud Billing client libraries.
+
+    Deferred to main() so importing this module (or exiting early on a missing
+    project file) doesn't pay for loading grpc and the generated protos.
+    The library is installed by init.sh; if it's missing, exit with a hint
+    instead of blocking on a pip install here.
+    """
+    global billing_v1, exceptions, ClientOptions
+    try:
+        from google.cloud import billing_v1
+        from google.api_core import exceptions
+        from google.api_core.client_options import ClientOptions
+    except ImportError:
+        print("❌ Error: google-cloud-billing is not installed.")
+        print(
+            "   Run init.sh first, or: python3 -m pip install --user --break-system-packages google-cloud-billing"
+        )
+        sys.exit(1)
+
 
 def get_project_id() -> str:
     """Reads the project ID from the file created by the init.sh script."""
@@ -59,21 +95,49 @@ def get_project_id() -> str:
     if not os.path.exists(project_file):
         print(f"❌ Error: Project ID file not found at {project_file}")
         sys.exit(1)
+    # The file holds a ~30-byte ASCII project ID, so a single raw read is enough
+    fd = os.open(project_file, os.O_RDONLY)
     try:
-        with open(project_file, "r") as f:
-            project_id = f.read().strip()
-        if not project_id:
-            print("❌ Error: Project ID file is empty.")
-            sys.exit(1)
-        return project_id
-    except Exception as e:
-        print(f"❌ Error reading project ID from file: {e}")
+        data = os.read(fd, 256)
+    finally:
+        os.close(fd)
+    project_id = data.decode("ascii").strip()
+    if not project_id:
+        print("❌ Error: Project ID file is empty.")
         sys.exit(1)
+    return project_id
 
 
 def enable_billing_api(project_id: str) -> bool:
-    """Enable the Cloud Billing API using gcloud."""
+    """Enable the Cloud Billing API.
+
+    Uses the Service Usage client in-process, which avoids a gcloud cold start
+    and works where gcloud isn't on PATH. Falls back to gcloud if the
+    google-cloud-service-usage library isn't installed.
+    """
     print("   Enabling Cloud Billing API...")
+    try:
+        from google.cloud import service_usage_v1
+    except ImportError:
+        return _enable_billing_api_with_gcloud(project_id)
+
+    try:
+        client = service_usage_v1.ServiceUsageClient(
+            client_options=ClientOptions(quota_project_id=project_id)
+        )
+        request = service_usage_v1.EnableServiceRequest(
+            name=f"projects/{project_id}/services/cloudbilling.googleapis.com"
+        )
+        client.enable_service(request=request).result(timeout=60)
+        print("   ✓ Cloud Billing API enabled")
+        return True
+    except Exception as e:
+        print(f"   ❌ Error enabling API: {e}")
+        return False
+
+
+def _enable_billing_api_with_gcloud(project_id: str) -> bool:
+    """Enable the Cloud Billing API using gcloud."""
     try:
         subprocess.run(
             [
@@ -103,9 +167,19 @@ def enable_billing_api(project_id: str) -> bool:
         return False
 
 
-def get_billing_accounts(client: billing_v1.CloudBillingClient):
-    """Fetch billing accounts with error handling for API/permission issues."""
+def get_billing_accounts(
+    client: billing_v1.CloudBillingClient, probe_only: bool = False
+):
+    """Fetch billing accounts with error handling for API/permission issues.
+
+    With probe_only=True, a single-row page is requested and at most one
+    account is returned — enough to tell whether any account exists yet.
+    """
     try:
+        if probe_only:
+            request = billing_v1.ListBillingAccountsRequest(page_size=1)
+            first = next(iter(client.list_billing_accounts(request=request)), None)
+            return [first] if first is not None else []
         accounts = client.list_billing_accounts()
         return list(accounts)
     except exceptions.PermissionDenied as e:
@@ -118,9 +192,11 @@ def get_billing_accounts(client: billing_v1.CloudBillingClient):
             return "API_DISABLED_OR_PROPAGATING"
         else:
             # Actual permission issue
+            end_progress()
             print(f"   ❌ Permission denied: {e.message}")
             return "PERMISSION_DENIED"
     except Exception as e:
+        end_progress()
         print(f"   ❌ Unexpected error: {e}")
         return "UNEXPECTED_ERROR"
 
@@ -128,7 +204,11 @@ def get_billing_accounts(client: billing_v1.CloudBillingClient):
 def check_current_billing(
     client: billing_v1.CloudBillingClient, project_id: str
 ) -> tuple:
-    """Check if project already has billing enabled. Returns (is_enabled, account_name)."""
+    """Check if project already has billing enabled. Returns (is_enabled, account_name).
+
+    is_enabled is None when the check hit a retryable server error, so the
+    caller can retry instead of assuming billing is off.
+    """
     project_name = f"projects/{project_id}"
     try:
         info = client.get_project_billing_info(name=project_name)
@@ -137,27 +217,43 @@ def check_current_billing(
         return False, None
     except exceptions.NotFound:
         return False, None
+    except (
+        exceptions.ServiceUnavailable,
+        exceptions.DeadlineExceeded,
+        exceptions.InternalServerError,
+    ):
+        return None, None
     except Exception:
         return False, None
 
 
+@functools.lru_cache(maxsize=None)
+def get_account_suffix(display_name: str) -> str:
+    """Return our date suffix from a display name, or "" if it isn't tagged.
+
+    Memoized so every caller shares one classification per display name.
+    Keyed on the name itself, so a renamed (newly tagged) account is
+    classified afresh.
+    """
+    match = SUFFIX_PATTERN.search(display_name)
+    return match.group() if match else ""
+
+
 def get_linked_project_count(
     client: billing_v1.CloudBillingClient, billing_account
 ) -> int:
     """Count the number of projects linked to a billing account.
 
-    Returns 0 if the account has no linked projects (freshest account),
-    or -1 if the check fails (treat as unknown).
+    Only presence matters, so a single-row page is requested and the result
+    is capped at 1. Returns 0 if the account has no linked projects
+    (freshest account), or -1 if the check fails (treat as unknown).
     """
     try:
-        projects = client.list_project_billing_info(name=billing_account.name)
-        count = 0
-        for _ in projects:
-            count += 1
-            if count > 0:
-                # We only need to know if there's at least one; stop early
-                break
-        return count
+        request = billing_v1.ListProjectBillingInfoRequest(
+            name=billing_account.name, page_size=1
+        )
+        projects = client.list_project_billing_info(request=request)
+        return 1 if next(iter(projects), None) is not None else 0
     except Exception:
         # If we can't check, return -1 (unknown — don't penalize this account)
         return -1
@@ -173,35 +269,47 @@ def find_best_billing_account(
       2. Account with our suffix, preferring the newest suffix date
       3. First open account (fallback)
     """
-    # Priority 1: Find account with no linked projects (freshest)
-    unlinked_accounts = []
-    for account in open_accounts:
-        linked_count = get_linked_project_count(client, account)
-        if linked_count == 0:
-            unlinked_accounts.append(account)
-
-    if unlinked_accounts:
-        # Among unlinked, prefer accounts with "trial billing account" in the name
-        # (workshop credits typically use this naming convention)
-        unlinked_accounts.sort(
-            key=lambda a: "trial billing account" in a.display_name.lower(),
-            reverse=True,
+    # Classify every account once: (account, is_trial, suffix or "")
+    # "trial billing account" is the naming convention for workshop credits.
+    scored = [
+        (
+            account,
+            "trial billing account" in account.display_name.lower(),
+            get_account_suffix(account.display_name),
         )
-        account = unlinked_accounts[0]
-        print(f"   Selected unlinked (fresh) account: {account.display_name}")
-        return account
+        for account in open_accounts
+    ]
+
+    # Priority 1: Find account with no linked projects (freshest).
+    # Each probe is an independent RPC, so fan them out; the client is thread-safe.
+    # Probe in batches and stop at the first batch with an unlinked account.
+    # Trial accounts go first (stable sort), so stopping early still picks the
+    # same account a full scan would.
+    candidates = sorted(scored, key=lambda s: s[1], reverse=True)
+    with ThreadPoolExecutor(
+        max_workers=min(PROBE_BATCH_SIZE, len(candidates))
+    ) as executor:
+        for start in range(0, len(candidates), PROBE_BATCH_SIZE):
+            batch = candidates[start : start + PROBE_BATCH_SIZE]
+            results = list(
+                executor.map(
+                    lambda s: (s, get_linked_project_count(client, s[0])), batch
+                )
+            )
+            unlinked = [entry for entry, count in results if count == 0]
+
+            if unlinked:
+                # Among unlinked, prefer trial accounts (max keeps the first on ties)
+                account = max(unlinked, key=lambda s: s[1])[0]
+                print(f"   Selected unlinked (fresh) account: {account.display_name}")
+                return account
 
     # Priority 2: Among tagged accounts, pick the one with the newest suffix
-    tagged_accounts = []
-    for account in open_accounts:
-        match = SUFFIX_PATTERN.search(account.display_name)
-        if match:
-            tagged_accounts.append((account, match.group()))
-
-    if tagged_accounts:
-        # Sort by suffix descending (newest date first)
-        tagged_accounts.sort(key=lambda x: x[1], reverse=True)
-        account = tagged_accounts[0][0]
+    tagged = [entry for entry in scored if entry[2]]
+
+    if tagged:
+        # Suffixes are fixed-width timestamps, so the largest is the newest
+        account = max(tagged, key=lambda s: s[2])[0]
         print(f"   Selected newest tagged account: {account.display_name}")
         return account
 
@@ -218,7 +326,7 @@ def tag_billing_account(client: billing_v1.CloudBillingClient, account) -> None:
     Silently skips if permission denied (requires billing.accounts.update).
     """
     # Don't double-tag
-    if SUFFIX_PATTERN.search(account.display_name):
+    if get_account_suffix(account.display_name):
         return
 
     suffix = datetime.now().strftime("-%Y%m%d%H%M")
@@ -243,7 +351,7 @@ def tag_billing_account(client: billing_v1.CloudBillingClient, account) -> None:
 def link_billing_account(
     client: billing_v1.CloudBillingClient, project_id: str, billing_account
 ) -> bool:
-    """Link billing account to project and verify it's active."""
+    """Link billing account to project, tag the account, and verify it's active."""
     project_name = f"projects/{project_id}"
     billing_account_name = billing_account.name
     display_name = billing_account.display_name
@@ -254,7 +362,7 @@ def link_billing_account(
         project_billing_info = billing_v1.ProjectBillingInfo(
             billing_account_name=billing_account_name
         )
-        client.update_project_billing_info(
+        updated_info = client.update_project_billing_info(
             name=project_name, project_billing_info=project_billing_info
         )
     except exceptions.PermissionDenied as e:
@@ -265,10 +373,41 @@ def link_billing_account(
         print(f"   ❌ Failed to link: {e}")
         return False
 
+    # Tagging doesn't depend on the link being active, so run it alongside the
+    # verification polling; leaving the block waits for the tag to finish.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(tag_billing_account, client, billing_account)
+        return verify_billing_link(
+            client, project_name, billing_account_name, updated_info
+        )
+
+
+def verify_billing_link(
+    client: billing_v1.CloudBillingClient,
+    project_name: str,
+    billing_account_name: str,
+    updated_info,
+) -> bool:
+    """Wait for a freshly updated billing link to become active.
+
+    Always returns True: an unverified link may still be propagating, so the
+    caller optimistically continues.
+    """
+    # The update returns the new billing info; if it already shows the link as
+    # active there is nothing to poll for
+    if (
+        updated_info.billing_account_name == billing_account_name
+        and updated_info.billing_enabled
+    ):
+        print("   ✓ Billing verified active")
+        return True
+
     # Verify the link is active (can take a few seconds to propagate)
+    # Exponential backoff with jitter: early probes catch fast propagation,
+    # later ones stretch to cover the slow case (~50s total).
     print("   Verifying billing link...")
-    max_retries = 6
-    wait_seconds = 10
+    max_retries = 7
+    delay = 1.0
 
     for i in range(max_retries):
         try:
@@ -283,12 +422,29 @@ def link_billing_account(
             pass
 
         if i < max_retries - 1:
-            time.sleep(wait_seconds)
+            time.sleep(delay + random.random())
+            delay = min(delay * 2, 16.0)
 
     print("   ⚠️  Could not verify billing link (may still be propagating)")
     return True  # Optimistically continue
 
 
+def _input_with_timeout(prompt: str, timeout: float, default: str) -> str:
+    """Prompt for a line of input, returning `default` if none arrives in time.
+
+    Keeps unattended runs (CI, scripted workshop provisioning) from hanging
+    forever on a prompt nobody will answer. EOF also yields the default.
+    """
+    print(prompt, end="", flush=True)
+    ready, _, _ = select.select([sys.stdin], [], [], timeout)
+    line = sys.stdin.readline() if ready else ""
+    if not line:
+        print()
+        print(f"   ⏱  No selection made, auto-selecting option {default}")
+        return default
+    return line.strip()
+
+
 def main():
     """Main billing enablement flow."""
     print("💳 Checking billing configuration...")
@@ -297,52 +453,98 @@ def main():
     project_id = get_project_id()
     print(f"   Project: {project_id}")
 
-    # Initialize billing client
+    _lazy_import_billing()
+
+    # Initialize billing client. The default transport already multiplexes
+    # every RPC, including the concurrent probes, over one gRPC channel, so
+    # there is no need to hand-build one.
     billing_client = billing_v1.CloudBillingClient(
         client_options=ClientOptions(quota_project_id=project_id)
     )
 
-    # Check if billing is already enabled
+    # Check if billing is already enabled. Retry transient failures first so a
+    # flaky check doesn't send an already-billed project through discovery.
     is_enabled, current_account = check_current_billing(billing_client, project_id)
-    if is_enabled:
+    max_check_retries = 3
+    wait_seconds = 2
+    for i in range(max_check_retries):
+        if is_enabled is not None:
+            break
+        print_progress(
+            f"   Billing check failed, retry {i + 1}/{max_check_retries} in {wait_seconds}s..."
+        )
+        time.sleep(wait_seconds + random.random())
+        wait_seconds *= 2
+        is_enabled, current_account = check_current_billing(billing_client, project_id)
+    end_progress()
+
+    if is_enabled is None:
+        print("   ⚠️  Could not confirm billing status, continuing with account search")
+    elif is_enabled:
         print(f"✓ Billing already enabled")
         return 0
 
+    # The account from a previous run is deliberately not reused: reaching this
+    # point on a re-run means that link lapsed or was removed, and a freshly
+    # claimed credit should win the normal selection below.
     print("   Billing not enabled. Searching for billing accounts...")
 
     # Try to get billing accounts
     accounts_result = get_billing_accounts(billing_client)
 
-    # If API not ready, enable it and retry with backoff
-    if accounts_result == "API_DISABLED_OR_PROPAGATING":
-        if not enable_billing_api(project_id):
-            return 1
-
-        print("   Waiting for API to propagate...")
-        max_retries = 5
-        wait_seconds = 15
-
-        for i in range(max_retries):
-            print(f"   Retry {i + 1}/{max_retries} in {wait_seconds}s...")
-            time.sleep(wait_seconds)
-            accounts_result = get_billing_accounts(billing_client)
-            if accounts_result != "API_DISABLED_OR_PROPAGATING":
+    # Poll until we have accounts or run out of retries. A single loop covers
+    # both waits (API propagation, then credit propagation) so each sleep is
+    # followed by exactly one listing, and a non-empty list is never re-fetched.
+    api_enabled = False
+    max_api_retries = 5
+    api_retry = 0
+    api_wait_seconds = 15
+    max_wait_retries = 6
+    wait_retry = 0
+    polled = False
+
+    while True:
+        if accounts_result == "API_DISABLED_OR_PROPAGATING":
+            # If API not ready, enable it and retry with backoff
+            if not api_enabled:
+                if not enable_billing_api(project_id):
+                    return 1
+                api_enabled = True
+                print("   Waiting for API to propagate...")
+            if api_retry >= max_api_retries:
+                break
+            api_retry += 1
+            print_progress(
+                f"   Retry {api_retry}/{max_api_retries} in {api_wait_seconds}s..."
+            )
+            # Jitter spreads out retries when many attendees run setup at once
+            time.sleep(api_wait_seconds + random.random())
+            api_wait_seconds = int(api_wait_seconds * 1.5)
+        elif isinstance(accounts_result, list) and not accounts_result:
+            # If still no accounts, wait for potential credit propagation
+            if wait_retry == 0:
+                end_progress()
+                print("   No billing accounts found. Waiting for credit propagation...")
+                print("   (This can take up to 2 minutes if you just claimed credits)")
+            if wait_retry >= max_wait_retries:
                 break
-            wait_seconds = int(wait_seconds * 1.5)
+            wait_retry += 1
+            print_progress(f"   Waiting... ({wait_retry}/{max_wait_retries})")
+            time.sleep(20)
+        else:
+            break
 
-    # If still no accounts, wait for potential credit propagation
-    if isinstance(accounts_result, list) and not accounts_result:
-        print("   No billing accounts found. Waiting for credit propagation...")
-        print("   (This can take up to 2 minutes if you just claimed credits)")
+        # While polling we only need to know whether any account exists yet
+        accounts_result = get_billing_accounts(billing_client, probe_only=True)
+        polled = True
+        if wait_retry and isinstance(accounts_result, list) and accounts_result:
+            end_progress()
+            print("   ✓ Found billing accounts!")
+    end_progress()
 
-        max_wait_retries = 6
-        for i in range(max_wait_retries):
-            print(f"   Waiting... ({i + 1}/{max_wait_retries})")
-            time.sleep(20)
-            accounts_result = get_billing_accounts(billing_client)
-            if isinstance(accounts_result, list) and accounts_result:
-                print("   ✓ Found billing accounts!")
-                break
+    # A probe returns at most one account, so fetch the full list once
+    if polled and isinstance(accounts_result, list) and accounts_result:
+        accounts_result = get_billing_accounts(billing_client)
 
     # Handle final result
     if isinstance(accounts_result, list):
@@ -365,7 +567,8 @@ def main():
             print("╚═══════════════════════════════════════════════════════════════╝")
             return 1
 
-        # Filter to open accounts only
+        # Filter to open accounts only. This has to happen client-side: the
+        # ListBillingAccounts filter only supports master_billing_account=...
         open_accounts = [acc for acc in accounts_result if acc.open]
 
         if not open_accounts:
@@ -377,7 +580,6 @@ def main():
             account = open_accounts[0]
             print(f"   Found: {account.display_name}")
             if link_billing_account(billing_client, project_id, account):
-                tag_billing_account(billing_client, account)
                 print("✓ Billing configured successfully")
                 return 0
             return 1
@@ -387,7 +589,6 @@ def main():
         account = find_best_billing_account(billing_client, open_accounts)
         print(f"   Auto-selecting: {account.display_name}")
         if link_billing_account(billing_client, project_id, account):
-            tag_billing_account(billing_client, account)
             print("✓ Billing configured successfully")
             return 0
 
@@ -399,9 +600,21 @@ def main():
             print(f"   {i}. {acc.display_name}")
         print()
 
+        # Without a choice, fall back to the first account that didn't just fail
+        failed_index = open_accounts.index(account)
+        default_index = 1 if failed_index == 0 else 0
+        print(
+            f"   Defaults to {default_index + 1}. {open_accounts[default_index].display_name}"
+            f" after {MANUAL_SELECTION_TIMEOUT}s"
+        )
+
         while True:
             try:
-                choice = input(f"   Select account [1-{len(open_accounts)}]: ").strip()
+                choice = _input_with_timeout(
+                    f"   Select account [1-{len(open_accounts)}]: ",
+                    timeout=MANUAL_SELECTION_TIMEOUT,
+                    default=str(default_index + 1),
+                )
                 if not choice:
                     continue
                 index = int(choice) - 1
@@ -413,7 +626,6 @@ def main():
 
         account = open_accounts[index]
         if link_billing_account(billing_client, project_id, account):
-            tag_billing_account(billing_client, account)
             print("✓ Billing configured successfully")
             return 0
         return 1
@@ -145,8 +145,9 @@ echo -e "Using project: ${CYAN}${PROJECT_ID}${NC}"
 echo ""
 echo -e "${YELLOW}Checking billing configuration...${NC}"
 
-# Pre-install billing library (needed by billing-enablement.py)
-pip install --quiet --user google-cloud-billing 2>/dev/null || true
+# Install billing libraries (billing-enablement.py expects them to be present).
+# --break-system-packages lets --user installs work on externally-managed Pythons.
+python3 -m pip install --quiet --user --break-system-packages google-cloud-billing google-cloud-service-usage || true
 
 # Run the billing enablement script
 if ! python3 "${SCRIPT_DIR}/billing-enablement.py"; then